@@ -1,176 +1,374 @@
-from pyspark import SparkConf
-from pyspark.sql import SparkSession, udf
+import argparse
+import os
+
+from pyspark import SparkConf, SparkContext, StorageLevel
+from pyspark.sql import SparkSession
 import pyspark.sql.types as t
 import pyspark.sql.functions as f
 
 # As per instructions, sessionizing the dataset based on time (15 min)
 session_window_minutes = 15
 
+raw_log_path = "../data/*.log"
+parquet_path = "../data/parquet/"
+
+# Lower bounds for dynamic allocation, used unless they are given to spark-submit
+min_executors = 1
+initial_executors = 2
+
 
-@f.udf(t.StringType())
 def getSessionId(currentTimestamp, ip):
     ###
-    # Creating a helper UDF, but in reality I would install PyArrow and use Pandas UDF which are vectorized in nature
-    # and it is very fast compared to regular UDF
+    # Builds the session id purely from built-in column functions, so the whole computation stays inside the JVM
+    # and is code generated by Catalyst instead of round tripping every row through a Python UDF
     ###
 
-    start_block = end_block = ""
-    if 0 <= currentTimestamp.minute <= 14 or (currentTimestamp.minute == 15 and currentTimestamp.second == 0):
-        start_block = "00"
-        end_block = "15"
-    elif (currentTimestamp.minute == 15 and currentTimestamp.second > 0) or 16 <= currentTimestamp.minute <= 29 or (currentTimestamp.minute == 30 and currentTimestamp.second == 0):
-        start_block = "16"
-        end_block = "30"
-    elif (currentTimestamp.minute == 30 and currentTimestamp.second > 0) or 31 <= currentTimestamp.minute <= 44 or (currentTimestamp.minute == 45 and currentTimestamp.second == 0):
-        start_block = "31"
-        end_block = "45"
-    else:
-        start_block = "46"
-        end_block = "60"
+    # Seconds elapsed within the hour; a timestamp sitting exactly on a block boundary (eg. 15:00) still belongs
+    # to the block that ends there, hence the -1 before bucketing and the clamp for the very first second (00:00)
+    window_seconds = session_window_minutes * 60
+    second_of_hour = f.minute(currentTimestamp) * 60 + f.second(currentTimestamp)
+    block = f.floor((second_of_hour - 1) / window_seconds).cast('int')
+    block = f.when(block < 0, 0).otherwise(block)
+
+    # Blocks are labelled 00-15, 16-30, 31-45 and 46-60
+    start_block = f.when(block == 0, 0).otherwise(block * session_window_minutes + 1)
+    end_block = (block + 1) * session_window_minutes
 
     # Session Id is formed as yyyyMMdd-HH-start-endblock-ip
-    return "{}{}{}-{}-{}{}-{}".format(currentTimestamp.strftime("%Y"), currentTimestamp.strftime("%m"),
-                                     currentTimestamp.strftime("%d"), currentTimestamp.strftime("%H"),
-                                     start_block, end_block, ip.replace(".", "-"))
-
-
-# Enabling Shuffle service that can help in yarn container up/down scaling
-conf = SparkConf() \
-    .setAppName("weblog_solution") \
-    .set("spark.shuffle.service.enabled", True) \
-    .set("spark.dynamicAllocation.enabled", True)
-
-spark = SparkSession\
-    .builder\
-    .config(conf=conf)\
-    .enableHiveSupport()\
-    .getOrCreate()
-
-schema = "timestamp elb client_port backend_port request_processing_time backend_processing_time " \
-         "response_processing_time elb_status_code backend_status_code received_bytes sent_bytes request " \
-         "user_agent ssl_cipher ssl_protocol".split(" ")
-
-# For simplicity, loading the data from local FS, in reality it is expected to be in HDFS or S3
-# Also compression observed here is gz, its a non splittable type. For efficiency, we may choose LZO type
-# compression which can be splittable
-baseDF = spark\
-    .read\
-    .csv("../data/*.log", sep=" ", ignoreLeadingWhiteSpace=True, ignoreTrailingWhiteSpace=True)\
-    .toDF(*schema)\
-
-
-baseDF = baseDF.withColumn('timestamp', baseDF['timestamp'].cast('timestamp'))
-baseDF = baseDF.withColumn('ip', f.split(baseDF['client_port'], ':').getItem(0))
-baseDF = baseDF.withColumn('session_id', getSessionId(baseDF['timestamp'], baseDF['ip'])).cache()
-
-
-# 1. Sessionize the web log by IP.
-# As I am copying my output here, I am sorting the output by total_hits
-sessionDF = baseDF.select("timestamp", "ip", "session_id")
-sessionStatsDF = sessionDF\
-    .groupby("ip", "session_id")\
-    .agg(f.count('*').alias('total_hits'))\
-    .orderBy('total_hits', ascending=False).cache()
-
-# For demonstration of logic, I am issuing show action, in reality we may persist to HDFS or S3 or Hive
-sessionStatsDF.show(10, truncate=False)
-# +-------------+------------------------------+----------+
-# |ip           |session_id                    |total_hits|
-# +-------------+------------------------------+----------+
-# |52.74.219.71 |20150722-06-3145-52-74-219-71 |6016      |
-# |119.81.61.166|20150722-12-1630-119-81-61-166|5600      |
-# |106.186.23.95|20150722-17-0015-106-186-23-95|5114      |
-# |119.81.61.166|20150722-12-0015-119-81-61-166|4940      |
-# |106.51.132.54|20150722-12-0015-106-51-132-54|4399      |
-# |52.74.219.71 |20150722-14-0015-52-74-219-71 |4277      |
-# |52.74.219.71 |20150722-17-0015-52-74-219-71 |3831      |
-# |119.81.61.166|20150722-14-0015-119-81-61-166|3763      |
-# |119.81.61.166|20150722-13-3145-119-81-61-166|3440      |
-# |119.81.61.166|20150721-22-3145-119-81-61-166|3428      |
-# +-------------+------------------------------+----------+
-
-# 2. Average session time
-# I am assuming that the ask here is to compute average time spent by IP in a given session window
-# As I am copying my output here, I am sorting the output by avg_session_time_in_min
-avgSessionStatsBaseDF = baseDF.select("timestamp", "ip", "session_id")
-avgSessionStatsDF = avgSessionStatsBaseDF.groupby("ip", "session_id").agg(f.max("timestamp").alias('max_ts'),
-                                                                          f.min("timestamp").alias('min_ts'))
-avgSessionStatsDF = avgSessionStatsDF.withColumn("duration_sec", avgSessionStatsDF['max_ts'].cast('long') -
-                                                 avgSessionStatsDF['min_ts'].cast('long'))
-avgSessionStatsDF = avgSessionStatsDF.groupby("ip").agg(f.count('session_id').alias('total_sessions'),
-                                                        f.sum('duration_sec').alias('total_duration_sec'))
-avgSessionStatsDF = avgSessionStatsDF.withColumn("avg_session_time_in_min",
-                                                 (avgSessionStatsDF['total_duration_sec'] / 60) /
-                                                 avgSessionStatsDF['total_sessions']) \
-    .orderBy('avg_session_time_in_min', ascending=False)
-
-# For demonstration of logic, I am issuing show action, in reality we may persist to HDFS or S3 or Hive
-avgSessionStatsDF.show(10, truncate=False)
-# +---------------+--------------+------------------+-----------------------+
-# |ip             |total_sessions|total_duration_sec|avg_session_time_in_min|
-# +---------------+--------------+------------------+-----------------------+
-# |119.235.53.134 |1             |594               |9.9                    |
-# |117.229.207.237|1             |556               |9.266666666666667      |
-# |148.177.195.5  |1             |554               |9.233333333333333      |
-# |103.17.82.118  |1             |551               |9.183333333333334      |
-# |59.93.100.76   |1             |551               |9.183333333333334      |
-# |59.89.31.116   |1             |549               |9.15                   |
-# |101.60.239.65  |1             |548               |9.133333333333333      |
-# |1.22.38.150    |1             |547               |9.116666666666667      |
-# |117.222.221.14 |1             |547               |9.116666666666667      |
-# |14.98.69.1     |1             |546               |9.1                    |
-# +---------------+--------------+------------------+-----------------------+
-
-
-# 3. Determine unique URL visits per session. To clarify, count a hit to a unique URL only once per session
-# As I am copying my output here, I am sorting the output by num_unique_hits
-uniqueURLBaseDF = baseDF.select("session_id", "request")
-uniqueURLBaseDF = uniqueURLBaseDF.withColumn("url", f.split("request", " ").getItem(1))
-uniqueURLDF = uniqueURLBaseDF.groupby('session_id').agg(f.countDistinct('url').alias('num_unique_hits'))\
-    .orderBy('num_unique_hits', ascending=False)
-
-# For demonstration of logic, I am issuing show action, in reality we may persist to HDFS or S3 or Hive
-uniqueURLDF.show(10, truncate=False)
-# +------------------------------+---------------+
-# |session_id                    |num_unique_hits|
-# +------------------------------+---------------+
-# |20150722-12-1630-119-81-61-166|5496           |
-# |20150722-06-3145-52-74-219-71 |5057           |
-# |20150722-12-0015-119-81-61-166|4851           |
-# |20150722-17-0015-106-186-23-95|4656           |
-# |20150722-14-0015-119-81-61-166|3637           |
-# |20150721-22-3145-119-81-61-166|3333           |
-# |20150722-13-3145-119-81-61-166|3323           |
-# |20150722-12-1630-52-74-219-71 |2967           |
-# |20150722-14-0015-52-74-219-71 |2907           |
-# |20150722-17-0015-119-81-61-166|2841           |
-# +------------------------------+---------------+
-
-# 4. Find the most engaged users, ie the IPs with the longest session times
-# I am appending IP and Hash value of User agent, there by assuming each user agent within same ip
-# corresponds to different user
-# I am also assuming that we are trying to find most engaged users based on session times
-# (not across all the sessions_ids, which would become most engaged user of a day)
-# As I am copying my output here, I am sorting the output by duration_min
-mostEngaugedBaseDF = baseDF.select("timestamp", "session_id", "ip", "user_agent")
-mostEngaugedBaseDF = mostEngaugedBaseDF.withColumn("user", f.concat("ip", f.lit('_'), f.sha2("user_agent", 256)))
-mostEngaugedDF = mostEngaugedBaseDF.groupby('user', 'session_id')\
-    .agg((f.max('timestamp').cast('long') - f.min('timestamp').cast('long')) / 60)\
-    .toDF("user", "session_id", "duration_min")\
-    .orderBy("duration_min", ascending=False)
-
-mostEngaugedDF.show(10, truncate=False)
-# +--------------------------------------------------------------------------------+--------------------------------+------------------+
-# |user                                                                            |session_id                      |duration_min      |
-# +--------------------------------------------------------------------------------+--------------------------------+------------------+
-# |111.119.199.22_f54af9f03ea52c6a4f3d0873010fa93778a1e387399baf0c331558235b47d37b |20150722-06-3145-111-119-199-22 |13.983333333333333|
-# |117.220.186.227_3a5a319663e42275d264c0d49636fe3673c4ace35a759d89f400715744532cbd|20150722-06-3145-117-220-186-227|13.4              |
-# |15.211.153.75_180050cb76309ecd4e9e895a18ed06b490500b93ab309126d91a9719e69097b7  |20150722-06-3145-15-211-153-75  |9.933333333333334 |
-# |119.235.53.134_3a5a319663e42275d264c0d49636fe3673c4ace35a759d89f400715744532cbd |20150722-06-3145-119-235-53-134 |9.9               |
-# |116.50.79.74_3a5a319663e42275d264c0d49636fe3673c4ace35a759d89f400715744532cbd   |20150722-06-3145-116-50-79-74   |9.65              |
-# |52.74.219.71_3973e022e93220f9212c18d0d0c543ae7c309e46640da93a4a0314de999f5112   |20150722-06-3145-52-74-219-71   |9.316666666666666 |
-# |106.186.23.95_3973e022e93220f9212c18d0d0c543ae7c309e46640da93a4a0314de999f5112  |20150722-06-3145-106-186-23-95  |9.316666666666666 |
-# |52.74.219.71_043937ea8abaea325dbde1020b1bdd9f921dcbae7450dc9141c47a7d3473c917   |20150722-06-3145-52-74-219-71   |9.316666666666666 |
-# |14.139.85.180_174f0a6b8501c4d65307a711a29772fe0161b3ef8482f95a789030aa3e35146f  |20150722-06-3145-14-139-85-180  |9.3               |
-# |119.81.61.166_6563296a7f163a1c1c3d95555ed88fa755e8bdc852331d89cd3a8d4c173f81c4  |20150722-06-3145-119-81-61-166  |9.3               |
-# +--------------------------------------------------------------------------------+--------------------------------+------------------+
+    return f.concat(f.date_format(currentTimestamp, 'yyyyMMdd-HH-'),
+                    f.lpad(start_block.cast('string'), 2, '0'),
+                    f.lpad(end_block.cast('string'), 2, '0'),
+                    f.lit('-'),
+                    f.regexp_replace(ip, r'\.', '-'))
+
+
+def showTopK(df, order, k=10):
+    ###
+    # Fetches the top k rows by the given column with a single collect and prints them in the same layout as
+    # show(truncate=False), the rows are returned for any further use on the driver
+    ###
+    rows = df.orderBy(f.desc(order)).limit(k).collect()
+
+    table = [df.columns] + [["null" if value is None else str(value) for value in row] for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(df.columns))]
+    border = "+" + "+".join("-" * width for width in widths) + "+"
+
+    print(border)
+    for i, line in enumerate(table):
+        print("|" + "|".join(value.ljust(width) for value, width in zip(line, widths)) + "|")
+        if i == 0:
+            print(border)
+    print(border)
+
+    return rows
+
+
+def isConverted(spark, path):
+    ###
+    # Spark only writes the _SUCCESS marker once a write has fully committed, so a directory left behind by a failed
+    # or interrupted conversion is not mistaken for a usable copy. Checked through the Hadoop FileSystem so this
+    # works for HDFS and S3 paths as well as the local FS
+    ###
+    jvm = spark.sparkContext._jvm
+    success_path = jvm.org.apache.hadoop.fs.Path(path, "_SUCCESS")
+    fs = success_path.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration())
+    return fs.exists(success_path)
+
+
+def convertLogs(spark):
+    ###
+    # Converts the raw logs to Snappy compressed Parquet, replacing any previous copy. Compression observed in the
+    # raw logs is gz, its a non splittable type, so each file is read by a single task. Parquet compresses each row
+    # group independently so the copy is splittable across all cores, and every later run only fetches the columns
+    # it actually needs. Has to be run again whenever new logs are added
+    ###
+    spark\
+        .read\
+        .csv(raw_log_path, schema=schema, sep=" ", ignoreLeadingWhiteSpace=True, ignoreTrailingWhiteSpace=True)\
+        .write\
+        .mode("overwrite")\
+        .option("compression", "snappy")\
+        .parquet(parquet_path)
+
+
+def writeResult(df, output_path, name, key):
+    ###
+    # Persists the full result as ZSTD compressed Parquet under output_path/name. Rows are sorted by the key within
+    # each file, so the repeated ip/session_id strings dictionary and run length encode well and the row group
+    # statistics let readers skip everything but the key values they filter on. Partitioning the output by ip
+    # instead would create a directory per IP, tens of thousands of tiny files
+    ###
+    df\
+        .sortWithinPartitions(key)\
+        .write\
+        .mode("overwrite")\
+        .option("compression", "zstd")\
+        .parquet(os.path.join(output_path, name))
+
+
+def createSparkConf(max_executors=None):
+    ###
+    # Enabling Shuffle service that can help in yarn container up/down scaling
+    # Dynamic allocation starts from a couple of executors rather than one, and is capped when a maximum is given.
+    # The sizing settings use setIfMissing, so whatever is passed to spark-submit takes precedence
+    # Adaptive query execution coalesces small shuffle partitions at runtime. It does not help with the few heavy
+    # IPs (eg. 52.74.219.71), skew handling only applies to joins and a single hot session_id can not be split
+    ###
+    conf = SparkConf() \
+        .setAppName("weblog_solution") \
+        .set("spark.shuffle.service.enabled", True) \
+        .set("spark.dynamicAllocation.enabled", True) \
+        .setIfMissing("spark.dynamicAllocation.minExecutors", min_executors) \
+        .set("spark.sql.adaptive.enabled", True) \
+        .set("spark.sql.adaptive.coalescePartitions.enabled", True)
+
+    if max_executors is not None:
+        conf.set("spark.dynamicAllocation.maxExecutors", max_executors)
+
+    # Spark refuses to start when the initial number of executors is above the maximum
+    configured_max_executors = conf.get("spark.dynamicAllocation.maxExecutors")
+    if configured_max_executors is None:
+        conf.setIfMissing("spark.dynamicAllocation.initialExecutors", initial_executors)
+    else:
+        conf.setIfMissing("spark.dynamicAllocation.initialExecutors",
+                          min(initial_executors, int(configured_max_executors)))
+
+    return conf
+
+
+def clusterCores(spark):
+    ###
+    # Total number of cores the job can scale up to, or None when that is not known up front. With dynamic
+    # allocation the executors registered at start up are only a fraction of it, so it has to come from the
+    # configured maximum number of executors and cores per executor
+    ###
+    sc = spark.sparkContext
+    conf = sc.getConf()
+    if sc.master.startswith("local") or conf.get("spark.dynamicAllocation.enabled", "false") != "true":
+        return sc.defaultParallelism
+    if conf.contains("spark.dynamicAllocation.maxExecutors") and conf.contains("spark.executor.cores"):
+        return int(conf.get("spark.dynamicAllocation.maxExecutors")) * int(conf.get("spark.executor.cores"))
+    return None
+
+
+# Typing the columns up front lets the CSV reader parse the timestamp while scanning the file instead of casting
+# it afterwards. Status codes stay strings as the backend one is "-" when the request never reached a backend
+schema = t.StructType([
+    t.StructField("timestamp", t.TimestampType()),
+    t.StructField("elb", t.StringType()),
+    t.StructField("client_port", t.StringType()),
+    t.StructField("backend_port", t.StringType()),
+    t.StructField("request_processing_time", t.DoubleType()),
+    t.StructField("backend_processing_time", t.DoubleType()),
+    t.StructField("response_processing_time", t.DoubleType()),
+    t.StructField("elb_status_code", t.StringType()),
+    t.StructField("backend_status_code", t.StringType()),
+    t.StructField("received_bytes", t.LongType()),
+    t.StructField("sent_bytes", t.LongType()),
+    t.StructField("request", t.StringType()),
+    t.StructField("user_agent", t.StringType()),
+    t.StructField("ssl_cipher", t.StringType()),
+    t.StructField("ssl_protocol", t.StringType()),
+])
+
+
+def main(spark, output_path=None):
+    # For simplicity, loading the data from local FS, in reality it is expected to be in HDFS or S3
+    # The queries read the Parquet copy of the raw logs, see convertLogs
+    if not isConverted(spark, parquet_path):
+        raise RuntimeError("No complete Parquet copy of the logs at {}, run with --convert first".format(parquet_path))
+
+    # A copy written with an older schema (eg. timestamp as a string) would not fail below, unix_timestamp would
+    # silently return nulls for it, so the column types have to match exactly
+    logsDF = spark.read.parquet(parquet_path)
+    if logsDF.schema.simpleString() != schema.simpleString():
+        raise RuntimeError("Parquet copy of the logs at {} has schema {}, expected {}, run with --convert to "
+                           "regenerate it".format(parquet_path, logsDF.schema.simpleString(), schema.simpleString()))
+
+    # Deriving all the columns in two selects rather than chained withColumn calls, which keeps the logical plan
+    # small. Only the columns used by the queries below are cached, client_port is not needed once ip is derived
+    # The cached data is left as read, the aggregations below partially aggregate (or, for the distinct URL count,
+    # deduplicate) on the map side before shuffling, rather than repartitioning the wide request/user_agent rows
+    # Cached DataFrames are persisted serialized (MEMORY_ONLY is the serialized level in PySpark) to keep the
+    # footprint small, and are unpersisted as soon as their last query has run
+    baseDF = logsDF\
+        .select('timestamp',
+                f.substring_index('client_port', ':', 1).alias('ip'),
+                'request',
+                'user_agent')
+    baseDF = baseDF\
+        .select('timestamp', 'ip', getSessionId(baseDF['timestamp'], baseDF['ip']).alias('session_id'),
+                'request', 'user_agent')\
+        .persist(StorageLevel.MEMORY_ONLY)
+
+    # Session stats, average session time and most engaged users all need the same per session hits and time range,
+    # so they are computed in a single aggregation over baseDF and the three results are derived from this much
+    # smaller DataFrame. The time range is kept as unix seconds so durations are a plain subtraction.
+    # The user column is explained in 4.
+    userSessionStatsDF = baseDF\
+        .withColumn("user", f.when(f.col("user_agent").isNotNull(),
+                                   f.concat_ws('_', "ip", f.xxhash64("user_agent").cast('string'))))\
+        .groupby("ip", "user", "session_id")\
+        .agg(f.count('*').alias('hits'),
+             f.max(f.unix_timestamp("timestamp")).alias('max_ts'),
+             f.min(f.unix_timestamp("timestamp")).alias('min_ts'))\
+        .persist(StorageLevel.MEMORY_ONLY)
+
+    # 1. Sessionize the web log by IP.
+    # As I am copying my output here, I am sorting the output by total_hits
+    # Only the top 10 rows are shown, so each query sorts with orderBy + limit which Spark plans as a per partition
+    # top K (TakeOrderedAndProject) instead of a full global sort, see showTopK
+    sessionStatsDF = userSessionStatsDF\
+        .groupby("ip", "session_id")\
+        .agg(f.sum('hits').alias('total_hits'))
+
+    # For demonstration of logic, I am issuing show action, when an output path is given the full result is
+    # persisted as Parquet instead
+    if output_path:
+        writeResult(sessionStatsDF, output_path, "session_stats", "ip")
+    else:
+        showTopK(sessionStatsDF, 'total_hits')
+    # +-------------+------------------------------+----------+
+    # |ip           |session_id                    |total_hits|
+    # +-------------+------------------------------+----------+
+    # |52.74.219.71 |20150722-06-3145-52-74-219-71 |6016      |
+    # |119.81.61.166|20150722-12-1630-119-81-61-166|5600      |
+    # |106.186.23.95|20150722-17-0015-106-186-23-95|5114      |
+    # |119.81.61.166|20150722-12-0015-119-81-61-166|4940      |
+    # |106.51.132.54|20150722-12-0015-106-51-132-54|4399      |
+    # |52.74.219.71 |20150722-14-0015-52-74-219-71 |4277      |
+    # |52.74.219.71 |20150722-17-0015-52-74-219-71 |3831      |
+    # |119.81.61.166|20150722-14-0015-119-81-61-166|3763      |
+    # |119.81.61.166|20150722-13-3145-119-81-61-166|3440      |
+    # |119.81.61.166|20150721-22-3145-119-81-61-166|3428      |
+    # +-------------+------------------------------+----------+
+
+    # 2. Average session time
+    # I am assuming that the ask here is to compute average time spent by IP in a given session window
+    # As I am copying my output here, I am sorting the output by avg_session_time_in_min
+    avgSessionStatsDF = userSessionStatsDF\
+        .groupby("ip", "session_id")\
+        .agg((f.max("max_ts") - f.min("min_ts")).alias('duration_sec'))\
+        .groupby("ip")\
+        .agg(f.count('*').alias('total_sessions'),
+             f.sum('duration_sec').alias('total_duration_sec'))\
+        .withColumn("avg_session_time_in_min", f.col('total_duration_sec') / 60 / f.col('total_sessions'))
+
+    # For demonstration of logic, I am issuing show action, when an output path is given the full result is
+    # persisted as Parquet instead
+    if output_path:
+        writeResult(avgSessionStatsDF, output_path, "avg_session_stats", "ip")
+    else:
+        showTopK(avgSessionStatsDF, 'avg_session_time_in_min')
+    # +---------------+--------------+------------------+-----------------------+
+    # |ip             |total_sessions|total_duration_sec|avg_session_time_in_min|
+    # +---------------+--------------+------------------+-----------------------+
+    # |119.235.53.134 |1             |594               |9.9                    |
+    # |117.229.207.237|1             |556               |9.266666666666667      |
+    # |148.177.195.5  |1             |554               |9.233333333333333      |
+    # |103.17.82.118  |1             |551               |9.183333333333334      |
+    # |59.93.100.76   |1             |551               |9.183333333333334      |
+    # |59.89.31.116   |1             |549               |9.15                   |
+    # |101.60.239.65  |1             |548               |9.133333333333333      |
+    # |1.22.38.150    |1             |547               |9.116666666666667      |
+    # |117.222.221.14 |1             |547               |9.116666666666667      |
+    # |14.98.69.1     |1             |546               |9.1                    |
+    # +---------------+--------------+------------------+-----------------------+
+
+    # 3. Determine unique URL visits per session. To clarify, count a hit to a unique URL only once per session
+    # As I am copying my output here, I am sorting the output by num_unique_hits
+    uniqueURLDF = baseDF\
+        .select("session_id", f.split("request", " ").getItem(1).alias("url"))\
+        .groupby('session_id')\
+        .agg(f.countDistinct('url').alias('num_unique_hits'))
+
+    # For demonstration of logic, I am issuing show action, when an output path is given the full result is
+    # persisted as Parquet instead
+    if output_path:
+        writeResult(uniqueURLDF, output_path, "unique_url", "session_id")
+    else:
+        showTopK(uniqueURLDF, 'num_unique_hits')
+    baseDF.unpersist()
+    # +------------------------------+---------------+
+    # |session_id                    |num_unique_hits|
+    # +------------------------------+---------------+
+    # |20150722-12-1630-119-81-61-166|5496           |
+    # |20150722-06-3145-52-74-219-71 |5057           |
+    # |20150722-12-0015-119-81-61-166|4851           |
+    # |20150722-17-0015-106-186-23-95|4656           |
+    # |20150722-14-0015-119-81-61-166|3637           |
+    # |20150721-22-3145-119-81-61-166|3333           |
+    # |20150722-13-3145-119-81-61-166|3323           |
+    # |20150722-12-1630-52-74-219-71 |2967           |
+    # |20150722-14-0015-52-74-219-71 |2907           |
+    # |20150722-17-0015-119-81-61-166|2841           |
+    # +------------------------------+---------------+
+
+    # 4. Find the most engaged users, ie the IPs with the longest session times
+    # I am appending IP and Hash value of User agent, there by assuming each user agent within same ip
+    # corresponds to different user. A 64 bit xxHash is enough to tell user agents apart, the output below was
+    # produced with the earlier SHA-256 hash so only the hash part of the user differs
+    # I am also assuming that we are trying to find most engaged users based on session times
+    # (not across all the sessions_ids, which would become most engaged user of a day)
+    # As I am copying my output here, I am sorting the output by duration_min
+    mostEngaugedDF = userSessionStatsDF\
+        .select('user', 'session_id', ((f.col('max_ts') - f.col('min_ts')) / 60).alias("duration_min"))
+
+    if output_path:
+        writeResult(mostEngaugedDF, output_path, "most_engaged", "user")
+    else:
+        showTopK(mostEngaugedDF, 'duration_min')
+    userSessionStatsDF.unpersist()
+    # +--------------------------------------------------------------------------------+--------------------------------+------------------+
+    # |user                                                                            |session_id                      |duration_min      |
+    # +--------------------------------------------------------------------------------+--------------------------------+------------------+
+    # |111.119.199.22_f54af9f03ea52c6a4f3d0873010fa93778a1e387399baf0c331558235b47d37b |20150722-06-3145-111-119-199-22 |13.983333333333333|
+    # |117.220.186.227_3a5a319663e42275d264c0d49636fe3673c4ace35a759d89f400715744532cbd|20150722-06-3145-117-220-186-227|13.4              |
+    # |15.211.153.75_180050cb76309ecd4e9e895a18ed06b490500b93ab309126d91a9719e69097b7  |20150722-06-3145-15-211-153-75  |9.933333333333334 |
+    # |119.235.53.134_3a5a319663e42275d264c0d49636fe3673c4ace35a759d89f400715744532cbd |20150722-06-3145-119-235-53-134 |9.9               |
+    # |116.50.79.74_3a5a319663e42275d264c0d49636fe3673c4ace35a759d89f400715744532cbd   |20150722-06-3145-116-50-79-74   |9.65              |
+    # |52.74.219.71_3973e022e93220f9212c18d0d0c543ae7c309e46640da93a4a0314de999f5112   |20150722-06-3145-52-74-219-71   |9.316666666666666 |
+    # |106.186.23.95_3973e022e93220f9212c18d0d0c543ae7c309e46640da93a4a0314de999f5112  |20150722-06-3145-106-186-23-95  |9.316666666666666 |
+    # |52.74.219.71_043937ea8abaea325dbde1020b1bdd9f921dcbae7450dc9141c47a7d3473c917   |20150722-06-3145-52-74-219-71   |9.316666666666666 |
+    # |14.139.85.180_174f0a6b8501c4d65307a711a29772fe0161b3ef8482f95a789030aa3e35146f  |20150722-06-3145-14-139-85-180  |9.3               |
+    # |119.81.61.166_6563296a7f163a1c1c3d95555ed88fa755e8bdc852331d89cd3a8d4c173f81c4  |20150722-06-3145-119-81-61-166  |9.3               |
+    # +--------------------------------------------------------------------------------+--------------------------------+------------------+
+
+
+def positiveInt(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("{} is not a positive number".format(value))
+    return number
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sessionizes the web log and computes the session statistics")
+    parser.add_argument("--output-path", help="HDFS/S3/local directory to write the results to as Parquet, "
+                                              "when omitted the top 10 rows of each result are shown")
+    parser.add_argument("--convert", action="store_true",
+                        help="(Re)convert the raw logs to Parquet before running the queries, needed on the first run "
+                             "and whenever new logs are added")
+    parser.add_argument("--max-executors", type=positiveInt,
+                        help="Upper bound for dynamic allocation, when omitted spark-submit or Spark's default applies")
+    args = parser.parse_args()
+
+    # Starting the JVM before building the conf, so it is loaded with the spark-submit settings and setIfMissing
+    # only fills in what was not given there
+    SparkContext._ensure_initialized()
+    spark = SparkSession\
+        .builder\
+        .config(conf=createSparkConf(args.max_executors))\
+        .getOrCreate()
+
+    # Unless configured explicitly, shuffle partitions are sized to the cores the job can scale up to. When that is
+    # not known the default of 200 is kept, adaptive query execution only merges partitions at runtime, so it is
+    # better to start too high than too low
+    if not spark.sparkContext.getConf().contains("spark.sql.shuffle.partitions"):
+        cores = clusterCores(spark)
+        if cores:
+            spark.conf.set("spark.sql.shuffle.partitions", 2 * cores)
+
+    if args.convert:
+        convertLogs(spark)
+    main(spark, args.output_path)